@@ -0,0 +1,134 @@
+import atexit
+import logging
+import threading
+import time
+
+import psycopg2
+
+from db import apply_like_deltas, db_cursor, get_set_likes, has_liked_set, invalidate_published_sets, write_like
+
+# Likes and publish toggles are queued instead of written straight away. Rapid
+# toggles of the same thing collapse into whichever state is current when the
+# flusher gets to it, and like_count changes are summed per set before they are
+# applied.
+ACTION_COALESCE_SECONDS = 1.5
+MAX_FLUSH_ATTEMPTS = 5
+
+logger = logging.getLogger("quickflash.actions")
+
+action_queue = None
+action_queue_lock = threading.Lock()
+
+def get_action_queue():
+    # Created on first use, which also starts this process's flusher thread.
+    global action_queue
+    if action_queue is None:
+        with action_queue_lock:
+            if action_queue is None:
+                queue = {"lock": threading.Lock(), "pending": {}}
+                threading.Thread(target=run_action_flusher, args=(queue,), daemon=True).start()
+                # The flusher is a daemon thread, so whatever it has not written
+                # yet is flushed once more when the process exits.
+                atexit.register(flush_on_exit, queue)
+                action_queue = queue
+    return action_queue
+
+def queue_action(kind, user_id, set_id, value, current):
+    queue = get_action_queue()
+    now = time.monotonic()
+    with queue["lock"]:
+        entry = queue["pending"].get((kind, user_id, set_id))
+        if entry is None:
+            queue["pending"][(kind, user_id, set_id)] = {
+                "value": value, "base": current, "queued_at": now, "attempts": 0
+            }
+        else:
+            entry["value"] = value
+
+def pending_action_value(kind, user_id, set_id, default):
+    entry = get_action_queue()["pending"].get((kind, user_id, set_id))
+    return entry["value"] if entry else default
+
+def pending_like_delta(set_id):
+    queue = get_action_queue()
+    with queue["lock"]:
+        entries = list(queue["pending"].items())
+    return sum(
+        int(entry["value"]) - int(entry["base"])
+        for (kind, _, pending_set_id), entry in entries
+        if kind == "like" and pending_set_id == set_id
+    )
+
+def flush_actions(queue, force=False):
+    now = time.monotonic()
+    with queue["lock"]:
+        due = {
+            key: entry for key, entry in queue["pending"].items()
+            if force or now - entry["queued_at"] >= ACTION_COALESCE_SECONDS
+        }
+        for key in due:
+            del queue["pending"][key]
+    if not due:
+        return
+
+    like_deltas = {}
+    try:
+        with db_cursor() as cur:
+            for (kind, user_id, set_id), entry in due.items():
+                # Each entry gets its own savepoint so one bad row (a like on a
+                # set deleted meanwhile, say) is dropped without failing the rest.
+                cur.execute("SAVEPOINT queued_action")
+                try:
+                    if kind == "like":
+                        delta = write_like(cur, user_id, set_id, entry["value"])
+                        like_deltas[set_id] = like_deltas.get(set_id, 0) + delta
+                    elif kind == "publish":
+                        cur.execute("UPDATE flashcardset SET published = %s WHERE setID = %s",
+                                    (entry["value"], set_id))
+                except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+                    cur.execute("ROLLBACK TO SAVEPOINT queued_action")
+                    logger.warning("Dropping queued %s for set %s: %s", kind, set_id, e)
+                else:
+                    cur.execute("RELEASE SAVEPOINT queued_action")
+            apply_like_deltas(cur, like_deltas)
+    except Exception:
+        # Put the batch back unless a newer toggle has already replaced it, and
+        # wait a full coalescing window before trying again.
+        with queue["lock"]:
+            for key, entry in due.items():
+                entry["attempts"] += 1
+                entry["queued_at"] = now
+                if entry["attempts"] >= MAX_FLUSH_ATTEMPTS:
+                    logger.error("Giving up on queued %s for set %s after %d attempts",
+                                 key[0], key[2], entry["attempts"])
+                    continue
+                queue["pending"].setdefault(key, entry)
+        raise
+    if any(kind == "publish" for kind, _, _ in due):
+        invalidate_published_sets()
+
+def run_action_flusher(queue):
+    while True:
+        time.sleep(ACTION_COALESCE_SECONDS / 3)
+        try:
+            flush_actions(queue)
+        except Exception:
+            logger.exception("Action flush failed")
+
+def flush_on_exit(queue):
+    try:
+        flush_actions(queue, force=True)
+    except Exception:
+        logger.exception("Could not flush queued actions on exit")
+
+def toggle_like(user_id, set_id, liked):
+    # The stored state is the base, so liking an already-liked set (which the
+    # API allows) leaves the pending count unchanged.
+    return queue_action("like", user_id, set_id, liked, has_liked_set(user_id, set_id))
+
+def toggle_published(set_id, published):
+    return queue_action("publish", None, set_id, published, not published)
+
+def get_like_count(set_id):
+    # The stored count plus any likes still waiting in the queue.
+    return get_set_likes(set_id) + pending_like_delta(set_id)
@@ -0,0 +1,310 @@
+import time
+# Taken before the other imports so the warm-up timings include them.
+PROCESS_STARTED = time.perf_counter()
+
+import contextlib
+import hashlib
+import json
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+import actions
+import db
+import state_store
+import study_packs
+import warmup
+
+# JSON API for the mobile client and integrations. It shares the pooled data
+# layer in db.py with the Streamlit app but skips Streamlit entirely, so a request only pays for
+# its own queries. Run with: uvicorn api:app
+
+MAX_BATCH = 50
+IDEMPOTENCY_TTL = 600
+IN_PROGRESS = "a request with this key is still being processed"
+
+# ----- HELPERS -----
+def etag_matches(request, etag):
+    header = request.headers.get("if-none-match", "")
+    return header.strip() == "*" or etag in [tag.strip() for tag in header.split(",")]
+
+def json_response(request, data, status_code=200):
+    body = json.dumps(data, separators=(",", ":"), default=str).encode()
+    if request.method != "GET":
+        return Response(body, status_code, media_type="application/json")
+
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, status_code, media_type="application/json", headers={"ETag": etag})
+
+def error(message, status_code):
+    return JSONResponse({"error": message}, status_code)
+
+async def current_user(request):
+    # The session lookup reads (and now and then renews) the shared store, so
+    # it runs off the event loop like every other store and database call.
+    auth = request.headers.get("authorization", "")
+    if not auth.startswith("Bearer "):
+        return None
+    return await run_in_threadpool(state_store.get_session_user, auth[len("Bearer "):])
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+def set_rows(rows):
+    return [
+        {"set_id": set_id, "title": title, "subject": subject, "creator": creator}
+        for set_id, title, subject, creator in rows
+    ]
+
+def card_rows(rows):
+    return [
+        {"card_id": card_id, "question": question, "answer": answer}
+        for card_id, question, answer in rows
+    ]
+
+def record_progress(user_id, set_id):
+    if db.get_progress(user_id, set_id) == (0, 0):
+        db.initialize_progress(user_id, set_id, len(db.get_flashcards_in_set(set_id)))
+    db.increment_progress(user_id, set_id)
+    completed, total = db.get_progress(user_id, set_id)
+    return {"completed": completed, "total": total}
+
+def run_action(user_id, action, request_key=None):
+    # A retried request with the same key gets the first attempt's result back
+    # instead of liking, copying or counting progress a second time.
+    if request_key is None and action.get("request_key"):
+        request_key = str(action["request_key"])
+    if not request_key:
+        return apply_action(user_id, action)
+
+    # The key is reserved before anything runs, so two concurrent retries
+    # cannot both get through.
+    store = state_store.get_store()
+    store_key = f"idempotency:{user_id}:{request_key}"
+    request = {"action": action.get("action"), "set_id": action.get("set_id")}
+    if not store.add(store_key, {"request": request, "result": None}, ttl=IDEMPOTENCY_TTL):
+        stored = store.get(store_key) or {"request": request, "result": None}
+        if stored["request"] != request:
+            return {"set_id": action.get("set_id"), "error": "request key was already used for another action"}
+        if stored["result"] is None:
+            return {"set_id": action.get("set_id"), "error": IN_PROGRESS}
+        return stored["result"]
+
+    try:
+        result = apply_action(user_id, action)
+    except Exception:
+        store.delete(store_key)
+        raise
+    if "error" in result:
+        # Failed requests may be retried with the same key.
+        store.delete(store_key)
+    else:
+        store.set(store_key, {"request": request, "result": result}, ttl=IDEMPOTENCY_TTL)
+    return result
+
+def apply_action(user_id, action):
+    set_id = action.get("set_id")
+    if not isinstance(set_id, int) or not db.can_view_set(user_id, set_id):
+        return {"set_id": set_id, "error": "not found"}
+
+    kind = action.get("action")
+    if kind in ("like", "unlike"):
+        # Likes go through the coalescing queue, so the count returned already
+        # includes this change even though it has not been written yet.
+        actions.toggle_like(user_id, set_id, kind == "like")
+        return {"set_id": set_id, "liked": kind == "like", "likes": actions.get_like_count(set_id)}
+    if kind == "copy":
+        return {"set_id": set_id, "job_id": db.enqueue_job("copy_set", user_id, {"set_id": set_id})}
+    if kind == "progress":
+        return {"set_id": set_id, **record_progress(user_id, set_id)}
+    return {"set_id": set_id, "error": f"unknown action '{kind}'"}
+
+# ----- ENDPOINTS -----
+async def login(request):
+    data = await read_json(request)
+    if not isinstance(data, dict):
+        return error("expected a JSON object", 400)
+    user_id = await run_in_threadpool(db.login_user, data.get("email", ""), data.get("password", ""))
+    if not user_id:
+        return error("invalid credentials", 401)
+    token = await run_in_threadpool(state_store.create_session, user_id)
+    return json_response(request, {"token": token, "user_id": user_id})
+
+async def health(request):
+    # The warm-up report, for checking how long this process took to start.
+    return JSONResponse({
+        "status": "ok",
+        "startup_ms": {name: round(seconds * 1000) for name, seconds in warmup.startup_timings.items()}
+    })
+
+async def published_sets(request):
+    query = request.query_params.get("q")
+    if query:
+        rows = await run_in_threadpool(db.search_published_sets, query)
+    else:
+        rows = await run_in_threadpool(db.get_published_flashcard_sets)
+    return json_response(request, {"sets": set_rows(rows)})
+
+async def subjects(request):
+    def load():
+        counts = db.get_subject_set_counts()
+        return [
+            {"subject_id": subject_id, "name": name, "published_sets": counts.get(subject_id, 0)}
+            for subject_id, name in db.get_subjects()
+        ]
+    return json_response(request, {"subjects": await run_in_threadpool(load)})
+
+async def subject_sets(request):
+    try:
+        limit = min(int(request.query_params.get("limit", 20)), 100)
+    except ValueError:
+        return error("limit must be a number", 400)
+    if limit < 1:
+        return error("limit must be at least 1", 400)
+    rows = await run_in_threadpool(db.get_top_sets_in_subject, request.path_params["subject_id"], limit)
+    return json_response(request, {"sets": [
+        {"set_id": set_id, "title": title, "creator": creator, "likes": like_count}
+        for set_id, title, creator, like_count in rows
+    ]})
+
+async def set_cards(request):
+    set_id = request.path_params["set_id"]
+    if not await run_in_threadpool(db.can_view_set, await current_user(request), set_id):
+        return error("set not found", 404)
+    rows = await run_in_threadpool(db.get_flashcards_in_set, set_id)
+    return json_response(request, {"set_id": set_id, "cards": card_rows(rows)})
+
+async def study_pack(request):
+    # The pack is stored gzipped, so it is sent as-is to clients that accept
+    # gzip; its checksum ETag lets them skip the download when it has not
+    # changed.
+    set_id = request.path_params["set_id"]
+    if not await run_in_threadpool(db.can_view_set, await current_user(request), set_id):
+        return error("set not found", 404)
+    pack = await run_in_threadpool(study_packs.get_study_pack, set_id)
+    headers = {"ETag": pack["etag"], "Vary": "Accept-Encoding"}
+    if etag_matches(request, pack["etag"]):
+        return Response(status_code=304, headers=headers)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(pack["gzip"], media_type="application/json", headers=headers)
+    return json_response(request, pack["payload"])
+
+async def study_results(request):
+    user_id = await current_user(request)
+    if not user_id:
+        return error("login required", 401)
+    set_id = request.path_params["set_id"]
+    if not await run_in_threadpool(db.can_view_set, user_id, set_id):
+        return error("set not found", 404)
+    results = await read_json(request)
+    try:
+        counted = await run_in_threadpool(study_packs.apply_study_results, user_id, set_id, results)
+    except ValueError as e:
+        return error(str(e), 400)
+    completed, total = await run_in_threadpool(db.get_progress, user_id, set_id)
+    return json_response(request, {"set_id": set_id, "counted": counted, "completed": completed, "total": total})
+
+async def set_action(request):
+    user_id = await current_user(request)
+    if not user_id:
+        return error("login required", 401)
+    action = {"action": request.path_params["action"], "set_id": request.path_params["set_id"]}
+    if request.method == "DELETE":
+        if action["action"] != "like":
+            return error("only likes can be removed", 405)
+        action["action"] = "unlike"
+    request_key = request.headers.get("idempotency-key")
+    result = await run_in_threadpool(run_action, user_id, action, request_key)
+    if "error" in result:
+        status_codes = {"not found": 404, IN_PROGRESS: 409}
+        return error(result["error"], status_codes.get(result["error"], 400))
+    return json_response(request, result)
+
+async def job_status(request):
+    user_id = await current_user(request)
+    if not user_id:
+        return error("login required", 401)
+    job = await run_in_threadpool(db.get_job, request.path_params["job_id"], user_id)
+    if not job:
+        return error("job not found", 404)
+    job_id, kind, payload, status, progress, total, result, job_error = job
+    return json_response(request, {
+        "job_id": job_id, "kind": kind, "payload": payload, "status": status,
+        "progress": progress, "total": total, "result": result, "error": job_error
+    })
+
+async def cancel(request):
+    user_id = await current_user(request)
+    if not user_id:
+        return error("login required", 401)
+    if not await run_in_threadpool(db.cancel_job, request.path_params["job_id"], user_id):
+        return error("job not found or already finished", 404)
+    return json_response(request, {"job_id": request.path_params["job_id"], "cancel_requested": True})
+
+async def batch_cards(request):
+    data = await read_json(request)
+    set_ids = data.get("set_ids") if isinstance(data, dict) else None
+    if not isinstance(set_ids, list) or len(set_ids) > MAX_BATCH:
+        return error(f"expected up to {MAX_BATCH} set_ids", 400)
+
+    user_id = await current_user(request)
+    def load():
+        return {
+            str(set_id): card_rows(db.get_flashcards_in_set(set_id))
+            for set_id in set_ids
+            if isinstance(set_id, int) and db.can_view_set(user_id, set_id)
+        }
+    return json_response(request, {"sets": await run_in_threadpool(load)})
+
+async def batch_actions(request):
+    user_id = await current_user(request)
+    if not user_id:
+        return error("login required", 401)
+    data = await read_json(request)
+    actions = data.get("actions") if isinstance(data, dict) else None
+    if not isinstance(actions, list) or len(actions) > MAX_BATCH:
+        return error(f"expected up to {MAX_BATCH} actions", 400)
+
+    def apply():
+        return [
+            run_action(user_id, action) if isinstance(action, dict) else {"error": "expected an object"}
+            for action in actions
+        ]
+    return json_response(request, {"results": await run_in_threadpool(apply)})
+
+routes = [
+    Route("/api/login", login, methods=["POST"]),
+    Route("/api/health", health, methods=["GET"]),
+    Route("/api/sets", published_sets, methods=["GET"]),
+    Route("/api/subjects", subjects, methods=["GET"]),
+    Route("/api/subjects/{subject_id:int}/sets", subject_sets, methods=["GET"]),
+    Route("/api/sets/{set_id:int}/cards", set_cards, methods=["GET"]),
+    Route("/api/sets/{set_id:int}/pack", study_pack, methods=["GET"]),
+    Route("/api/sets/{set_id:int}/results", study_results, methods=["POST"]),
+    Route("/api/sets/{set_id:int}/{action}", set_action, methods=["POST", "DELETE"]),
+    Route("/api/jobs/{job_id:int}", job_status, methods=["GET"]),
+    Route("/api/jobs/{job_id:int}", cancel, methods=["DELETE"]),
+    Route("/api/batch/cards", batch_cards, methods=["POST"]),
+    Route("/api/batch/actions", batch_actions, methods=["POST"]),
+]
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    await run_in_threadpool(warmup.warm_up, PROCESS_STARTED)
+    yield
+
+app = Starlette(
+    routes=routes,
+    middleware=[Middleware(GZipMiddleware, minimum_size=500)],
+    lifespan=lifespan
+)
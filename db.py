@@ -0,0 +1,616 @@
+import contextlib
+import json
+import threading
+
+import psycopg2
+import psycopg2.pool
+
+from rendering import prerender_card
+from state_store import bump_version, cached_read, get_version, invalidate_cache
+
+# Data layer shared by the Streamlit app (main.py), the JSON API (api.py) and
+# the job workers (worker.py). Nothing here imports Streamlit.
+
+DB_SETTINGS = {
+    "dbname": "flashcards",
+    "user": "postgres",
+    "password": "password",
+    "host": "localhost",
+    "port": "5432"
+}
+
+# psycopg2 opens DB_POOL_MIN connections when the pool is created and keeps
+# that many idle; extra connections up to DB_POOL_MAX are closed on release.
+DB_POOL_MIN = 5
+DB_POOL_MAX = 20
+DB_CONNECT_TIMEOUT = 30
+# Arbitrary key for the advisory lock that serialises ensure_schema.
+SCHEMA_LOCK_ID = 726135
+
+# One slot per pooled connection, so a burst of threads waits its turn.
+db_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+
+db_pool = None
+db_pool_lock = threading.Lock()
+
+# One pool per process. This module is imported once, so the pool survives
+# Streamlit reruns and is shared by every session in the process.
+def get_db_pool():
+    global db_pool
+    if db_pool is None:
+        with db_pool_lock:
+            if db_pool is None:
+                pool = psycopg2.pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, **DB_SETTINGS)
+                try:
+                    ensure_schema(pool)
+                except Exception:
+                    # Otherwise the next call would open a second pool and
+                    # this one's connections would never be closed.
+                    pool.closeall()
+                    raise
+                db_pool = pool
+    return db_pool
+
+def ensure_schema(pool):
+    conn = pool.getconn()
+    try:
+        cur = conn.cursor()
+        # Every process (Streamlit, API, workers) runs this as it starts, often
+        # at the same moment; the lock makes them take turns.
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_ID,))
+
+        # flashcardset.like_count is a running total kept next to the likes
+        # table so pages can show counts without a COUNT(*) per set.
+        cur.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'flashcardset' AND column_name = 'like_count'
+        """)
+        if not cur.fetchone():
+            cur.execute("ALTER TABLE flashcardset ADD COLUMN IF NOT EXISTS like_count INTEGER NOT NULL DEFAULT 0")
+            cur.execute("""
+                UPDATE flashcardset f
+                SET like_count = (SELECT COUNT(*) FROM likes l WHERE l.setID = f.setID)
+            """)
+
+        # Queue for worker.py. Workers claim rows with FOR UPDATE SKIP LOCKED.
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                jobID SERIAL PRIMARY KEY,
+                kind TEXT NOT NULL,
+                userID INTEGER,
+                payload JSONB NOT NULL DEFAULT '{}',
+                status TEXT NOT NULL DEFAULT 'queued',
+                progress INTEGER NOT NULL DEFAULT 0,
+                total INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 3,
+                cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+                result JSONB,
+                error TEXT,
+                run_after TIMESTAMP NOT NULL DEFAULT NOW(),
+                created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS jobs_queue_idx ON jobs (status, run_after)")
+        cur.execute("CREATE INDEX IF NOT EXISTS jobs_user_idx ON jobs (userID, jobID)")
+
+        # Backs browsing by subject: the top sets in a subject are one range scan,
+        # and per-subject published counts can be read from the index alone.
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS flashcardset_subject_browse_idx
+            ON flashcardset (subjectID, published, like_count DESC)
+        """)
+        conn.commit()
+    finally:
+        conn.rollback()
+        pool.putconn(conn)
+
+def connect_db():
+    # The pool raises PoolError instead of waiting when every connection is
+    # out, so callers queue on db_slots for up to DB_CONNECT_TIMEOUT first.
+    if not db_slots.acquire(timeout=DB_CONNECT_TIMEOUT):
+        raise psycopg2.pool.PoolError(f"no database connection free after {DB_CONNECT_TIMEOUT} seconds")
+    try:
+        return get_db_pool().getconn()
+    except Exception:
+        db_slots.release()
+        raise
+
+def release_db(conn):
+    # Anything left uncommitted is rolled back so the next borrower starts clean.
+    try:
+        conn.rollback()
+    finally:
+        get_db_pool().putconn(conn)
+        db_slots.release()
+
+@contextlib.contextmanager
+def db_cursor():
+    # Commits if the block finishes and always hands the connection back, so a
+    # failing query cannot leak it out of the pool.
+    conn = connect_db()
+    try:
+        yield conn.cursor()
+        conn.commit()
+    finally:
+        release_db(conn)
+
+# ----- PASSWORD UTILITIES -----
+# bcrypt is only needed when someone signs up or logs in, so it is imported on
+# first use rather than by every page.
+def hash_password(password):
+    import bcrypt
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+
+def check_password(password, hashed):
+    import bcrypt
+    return bcrypt.checkpw(password.encode(), hashed.encode())
+
+# ----- DATABASE OPERATIONS -----
+def add_user(username, email, password):
+    # Raises on failure (a taken email, say) so the caller can show why.
+    hashed_pw = hash_password(password)
+    with db_cursor() as cur:
+        cur.execute("INSERT INTO users (username, email, password_hash) VALUES (%s, %s, %s)",
+                    (username, email, hashed_pw))
+    return True
+
+def login_user(email, password):
+    with db_cursor() as cur:
+        cur.execute("SELECT userID, password_hash FROM users WHERE email = %s", (email,))
+        user = cur.fetchone()
+
+    if user and check_password(password, user[1]):
+        return user[0]  
+    else:
+        return None
+
+def get_user_info(user_id):
+    with db_cursor() as cur:
+        cur.execute("SELECT username, email FROM users WHERE userID = %s", (user_id,))
+        user = cur.fetchone()
+    return user if user else ("Unknown", "Unknown")
+
+def create_flashcard_set(user_id, title, subject_id):
+    with db_cursor() as cur:
+        cur.execute("""
+            INSERT INTO flashcardset (title, userID, subjectID)
+            VALUES (%s, %s, %s) RETURNING setID;
+        """, (title, user_id, subject_id))
+        set_id = cur.fetchone()[0]
+    return set_id
+
+def get_user_flashcard_sets(user_id):
+    with db_cursor() as cur:
+        cur.execute("""
+            SELECT flashcardset.setID, flashcardset.title, subject.name
+            FROM flashcardset
+            JOIN subject ON flashcardset.subjectID = subject.subjectID
+            WHERE flashcardset.userID = %s;
+        """, (user_id,))
+        sets = cur.fetchall()
+    return sets
+
+def get_flashcards_in_set(set_id):
+    with db_cursor() as cur:
+        cur.execute("""
+            SELECT flashcard.cardID, flashcard.question, flashcard.answer
+            FROM flashcard
+            JOIN contains ON flashcard.cardID = contains.cardID
+            WHERE contains.setID = %s
+            ORDER BY flashcard.cardID;
+        """, (set_id,))
+        flashcards = cur.fetchall()
+    return flashcards
+
+def add_flashcard_to_set(set_id, question, answer):
+    with db_cursor() as cur:
+        cur.execute("""
+            INSERT INTO flashcard (question, answer)
+            VALUES (%s, %s) RETURNING cardID;
+        """, (question, answer))
+        card_id = cur.fetchone()[0]
+        cur.execute("""
+            INSERT INTO contains (cardID, setID)
+            VALUES (%s, %s);
+        """, (card_id, set_id))
+    prerender_card(card_id, question, answer)
+    invalidate_study_pack([set_id])
+    return card_id
+
+def update_flashcard(card_id, question, answer):
+    with db_cursor() as cur:
+        cur.execute("""
+            UPDATE flashcard
+            SET question = %s, answer = %s
+            WHERE cardID = %s;
+        """, (question, answer, card_id))
+        cur.execute("SELECT setID FROM contains WHERE cardID = %s;", (card_id,))
+        set_ids = [row[0] for row in cur.fetchall()]
+    prerender_card(card_id, question, answer)
+    invalidate_study_pack(set_ids)
+
+def delete_flashcard(card_id):
+    with db_cursor() as cur:
+        cur.execute("DELETE FROM contains WHERE cardID = %s RETURNING setID;", (card_id,))
+        set_ids = [row[0] for row in cur.fetchall()]
+        cur.execute("DELETE FROM flashcard WHERE cardID = %s;", (card_id,))
+    invalidate_study_pack(set_ids)
+
+def get_published_flashcard_sets():
+    return cached_read("published_sets", 60, load_published_flashcard_sets)
+
+def load_published_flashcard_sets():
+    with db_cursor() as cur:
+        cur.execute("""
+            SELECT flashcardset.setID, flashcardset.title, subject.name, users.username
+            FROM flashcardset
+            JOIN subject ON flashcardset.subjectID = subject.subjectID
+            JOIN users ON flashcardset.userID = users.userID
+            WHERE flashcardset.published = TRUE;
+        """)
+        sets = cur.fetchall()
+    return sets
+
+def set_flashcardset_published(set_id, published=True):
+    with db_cursor() as cur:
+        cur.execute("UPDATE flashcardset SET published = %s WHERE setID = %s", (published, set_id))
+    invalidate_published_sets()
+
+def check_if_set_is_published(set_id):
+    with db_cursor() as cur:
+        cur.execute("SELECT published FROM flashcardset WHERE setID = %s", (set_id,))
+        result = cur.fetchone()
+    return result[0] if result else False
+
+def initialize_progress(user_id, set_id, total_cards):
+    with db_cursor() as cur:
+        cur.execute("""
+            INSERT INTO progress (userID, setID, completed_cards, total_cards)
+            VALUES (%s, %s, 0, %s)
+            ON CONFLICT (userID, setID) DO NOTHING;
+        """, (user_id, set_id, total_cards))
+
+def get_progress(user_id, set_id):
+    with db_cursor() as cur:
+        cur.execute("""
+            SELECT completed_cards, total_cards FROM progress
+            WHERE userID = %s AND setID = %s;
+        """, (user_id, set_id))
+        result = cur.fetchone()
+    return result if result else (0, 0)
+
+def increment_progress(user_id, set_id):
+    with db_cursor() as cur:
+        cur.execute("""
+            UPDATE progress
+            SET completed_cards = completed_cards + 1
+            WHERE userID = %s AND setID = %s AND completed_cards < total_cards;
+        """, (user_id, set_id))
+
+def reset_progress(user_id, set_id):
+    with db_cursor() as cur:
+        cur.execute("""
+            UPDATE progress
+            SET completed_cards = 0
+            WHERE userID = %s AND setID = %s;
+        """, (user_id, set_id))
+
+def copy_flashcard_set(original_set_id, new_owner_id, on_progress=None, job_id=None):
+    # on_progress may raise to abandon the copy; db_cursor then rolls it back.
+    with db_cursor() as cur:
+        cur.execute("""
+            SELECT title, subjectID FROM flashcardset WHERE setID = %s
+        """, (original_set_id,))
+        original = cur.fetchone()
+
+        if not original:
+            return None
+
+        title, subject_id = original
+        new_title = f"{title} (Copy)"
+
+        cur.execute("""
+            INSERT INTO flashcardset (title, userID, subjectID, published)
+            VALUES (%s, %s, %s, FALSE)
+            RETURNING setID
+        """, (new_title, new_owner_id, subject_id))
+        new_set_id = cur.fetchone()[0]
+
+        cur.execute("""
+            SELECT flashcard.question, flashcard.answer
+            FROM flashcard
+            JOIN contains ON flashcard.cardID = contains.cardID
+            WHERE contains.setID = %s
+            ORDER BY flashcard.cardID
+        """, (original_set_id,))
+        cards = cur.fetchall()
+
+        for copied, (question, answer) in enumerate(cards, start=1):
+            cur.execute("""
+                INSERT INTO flashcard (question, answer)
+                VALUES (%s, %s)
+                RETURNING cardID
+            """, (question, answer))
+            new_card_id = cur.fetchone()[0]
+
+            cur.execute("""
+                INSERT INTO contains (cardID, setID)
+                VALUES (%s, %s)
+            """, (new_card_id, new_set_id))
+            prerender_card(new_card_id, question, answer)
+
+            if on_progress and (copied % 25 == 0 or copied == len(cards)):
+                on_progress(copied, len(cards))
+        record_job_result(cur, job_id, {"new_set_id": new_set_id})
+    return new_set_id
+
+def delete_flashcard_set(set_id, user_id, on_progress=None, job_id=None):
+    with db_cursor() as cur:
+        cur.execute("SELECT setID FROM flashcardset WHERE setID = %s AND userID = %s", (set_id, user_id))
+        if not cur.fetchone():
+            return False
+
+        cur.execute("DELETE FROM contains WHERE setID = %s RETURNING cardID", (set_id,))
+        card_ids = [row[0] for row in cur.fetchall()]
+        if on_progress:
+            on_progress(1, 3)
+
+        # Only this set's cards can have become orphans, so there is no need to
+        # scan the whole flashcard table for them.
+        cur.execute("""
+            DELETE FROM flashcard f
+            WHERE f.cardID = ANY(%s)
+              AND NOT EXISTS (SELECT 1 FROM contains c WHERE c.cardID = f.cardID)
+        """, (card_ids,))
+        if on_progress:
+            on_progress(2, 3)
+
+        cur.execute("DELETE FROM progress WHERE setID = %s AND userID = %s", (set_id, user_id))
+
+        cur.execute("DELETE FROM flashcardset WHERE setID = %s", (set_id,))
+        record_job_result(cur, job_id, {"deleted": set_id})
+    invalidate_study_pack([set_id])
+    invalidate_published_sets()
+    return True
+
+def get_recommended_sets_by_subject_and_likes(user_id, limit=5):
+    with db_cursor() as cur:
+        cur.execute("""
+            SELECT f.setID, f.title, s.name AS subject, u.username,
+                (
+                    SELECT COUNT(*) FROM likes l WHERE l.setID = f.setID
+                ) AS like_count
+            FROM flashcardset f
+            JOIN subject s ON f.subjectID = s.subjectID
+            JOIN users u ON f.userID = u.userID
+            WHERE f.published = TRUE
+              AND f.userID != %s
+              AND f.subjectID IN (
+                  SELECT DISTINCT subjectID FROM flashcardset
+                  WHERE userID = %s
+              )
+            ORDER BY like_count DESC
+            LIMIT %s;
+        """, (user_id, user_id, limit))
+        sets = cur.fetchall()
+    return sets
+
+def write_like(cur, user_id, set_id, liked):
+    # Returns how much the set's like_count should move, which is 0 when the
+    # row was already in the requested state.
+    if liked:
+        cur.execute("""
+            INSERT INTO likes (userID, setID)
+            VALUES (%s, %s)
+            ON CONFLICT DO NOTHING;
+        """, (user_id, set_id))
+        return cur.rowcount
+    cur.execute("DELETE FROM likes WHERE userID = %s AND setID = %s", (user_id, set_id))
+    return -cur.rowcount
+
+def apply_like_deltas(cur, deltas):
+    # One UPDATE per set however many likes it collected; sorted so concurrent
+    # flushes lock hot rows in the same order.
+    for set_id, delta in sorted(deltas.items()):
+        if delta:
+            cur.execute("UPDATE flashcardset SET like_count = like_count + %s WHERE setID = %s",
+                        (delta, set_id))
+    if any(deltas.values()):
+        invalidate_cache("like_counts")
+
+def like_flashcard_set(user_id, set_id):
+    with db_cursor() as cur:
+        apply_like_deltas(cur, {set_id: write_like(cur, user_id, set_id, True)})
+
+def unlike_flashcard_set(user_id, set_id):
+    with db_cursor() as cur:
+        apply_like_deltas(cur, {set_id: write_like(cur, user_id, set_id, False)})
+
+def get_liked_set_ids(user_id):
+    with db_cursor() as cur:
+        cur.execute("SELECT setID FROM likes WHERE userID = %s", (user_id,))
+        liked = {row[0] for row in cur.fetchall()}
+    return liked
+
+def get_published_like_counts():
+    # Stored as pairs because JSON would turn integer dict keys into strings.
+    return dict(cached_read("like_counts", 30, load_published_like_counts))
+
+def load_published_like_counts():
+    with db_cursor() as cur:
+        cur.execute("SELECT setID, like_count FROM flashcardset WHERE published = TRUE")
+        counts = cur.fetchall()
+    return counts
+
+def has_liked_set(user_id, set_id):
+    with db_cursor() as cur:
+        cur.execute("SELECT 1 FROM likes WHERE userID = %s AND setID = %s", (user_id, set_id))
+        result = cur.fetchone()
+    return bool(result)
+
+def can_view_set(user_id, set_id):
+    with db_cursor() as cur:
+        cur.execute("""
+            SELECT 1 FROM flashcardset
+            WHERE setID = %s AND (published = TRUE OR userID = %s)
+        """, (set_id, user_id))
+        result = cur.fetchone()
+    return bool(result)
+
+def get_set_likes(set_id):
+    with db_cursor() as cur:
+        cur.execute("SELECT like_count FROM flashcardset WHERE setID = %s", (set_id,))
+        result = cur.fetchone()
+    return result[0] if result else 0
+
+def search_published_sets(query):
+    like_query = f"%{query.lower()}%"
+    with db_cursor() as cur:
+        cur.execute("""
+            SELECT f.setID, f.title, s.name AS subject, u.username
+            FROM flashcardset f
+            JOIN subject s ON f.subjectID = s.subjectID
+            JOIN users u ON f.userID = u.userID
+            WHERE f.published = TRUE
+              AND (
+                  LOWER(f.title) LIKE %s
+                  OR LOWER(s.name) LIKE %s
+              )
+        """, (like_query, like_query))
+        results = cur.fetchall()
+    return results
+
+def get_flashcard_set_title(set_id):
+    with db_cursor() as cur:
+        cur.execute("SELECT title FROM flashcardset WHERE setID = %s", (set_id,))
+        result = cur.fetchone()
+    return result[0] if result else None
+
+# ----- SUBJECTS -----
+# The subject list and each subject's published-set count are held in process
+# and reloaded only when the shared "subjects" version moves, which happens
+# whenever a set is published, unpublished or deleted.
+subject_catalog = {"version": None, "subjects": [], "counts": {}}
+
+def get_subject_catalog():
+    version = get_version("subjects")
+    if subject_catalog["version"] != version:
+        subjects, counts = load_subject_catalog()
+        subject_catalog.update(version=version, subjects=subjects, counts=counts)
+    return subject_catalog
+
+def load_subject_catalog():
+    with db_cursor() as cur:
+        cur.execute("SELECT subjectID, name FROM subject ORDER BY name")
+        subjects = cur.fetchall()
+        cur.execute("""
+            SELECT subjectID, COUNT(*) FROM flashcardset
+            WHERE published = TRUE
+            GROUP BY subjectID
+        """)
+        counts = dict(cur.fetchall())
+    return subjects, counts
+
+def get_subjects():
+    return get_subject_catalog()["subjects"]
+
+def get_subject_set_counts():
+    return get_subject_catalog()["counts"]
+
+def invalidate_subjects():
+    bump_version("subjects")
+
+def invalidate_published_sets():
+    invalidate_cache("published_sets")
+    invalidate_cache("like_counts")
+    invalidate_subjects()
+
+def get_top_sets_in_subject(subject_id, limit=20):
+    # The inner query is a single range scan of flashcardset_subject_browse_idx;
+    # usernames are joined on afterwards for just the rows that made the cut.
+    with db_cursor() as cur:
+        cur.execute("""
+            SELECT f.setID, f.title, u.username, f.like_count
+            FROM (
+                SELECT setID, title, userID, like_count
+                FROM flashcardset
+                WHERE subjectID = %s AND published = TRUE
+                ORDER BY like_count DESC
+                LIMIT %s
+            ) f
+            JOIN users u ON f.userID = u.userID
+            ORDER BY f.like_count DESC;
+        """, (subject_id, limit))
+        sets = cur.fetchall()
+    return sets
+
+def get_popular_set_ids(limit=20):
+    with db_cursor() as cur:
+        cur.execute("""
+            SELECT setID FROM flashcardset
+            WHERE published = TRUE
+            ORDER BY like_count DESC
+            LIMIT %s
+        """, (limit,))
+        set_ids = [row[0] for row in cur.fetchall()]
+    return set_ids
+
+def invalidate_study_pack(set_ids):
+    for set_id in set_ids:
+        bump_version(f"study_pack:{set_id}")
+
+# ----- BACKGROUND JOBS -----
+# Copies and deletes of whole sets are handed to worker.py instead of running
+# in the Streamlit script thread. These helpers only enqueue and inspect jobs.
+ACTIVE_JOB_STATUSES = ("queued", "running")
+
+def enqueue_job(kind, user_id, payload):
+    with db_cursor() as cur:
+        cur.execute("""
+            INSERT INTO jobs (kind, userID, payload)
+            VALUES (%s, %s, %s::jsonb) RETURNING jobID
+        """, (kind, user_id, json.dumps(payload)))
+        job_id = cur.fetchone()[0]
+    return job_id
+
+def record_job_result(cur, job_id, result):
+    # Called inside the transaction that does a job's work, so the result is
+    # committed together with it or not at all.
+    if job_id is not None:
+        cur.execute("UPDATE jobs SET result = %s::jsonb WHERE jobID = %s", (json.dumps(result), job_id))
+
+def get_job(job_id, user_id):
+    with db_cursor() as cur:
+        cur.execute("""
+            SELECT jobID, kind, payload, status, progress, total, result, error
+            FROM jobs WHERE jobID = %s AND userID = %s
+        """, (job_id, user_id))
+        job = cur.fetchone()
+    return job
+
+def get_user_jobs(user_id, limit=10):
+    with db_cursor() as cur:
+        cur.execute("""
+            SELECT jobID, kind, payload, status, progress, total, result, error
+            FROM jobs WHERE userID = %s
+            ORDER BY jobID DESC
+            LIMIT %s
+        """, (user_id, limit))
+        jobs = cur.fetchall()
+    return jobs
+
+def cancel_job(job_id, user_id):
+    # Queued jobs are cancelled outright; running ones see the flag at their
+    # next progress report and roll back.
+    with db_cursor() as cur:
+        cur.execute("""
+            UPDATE jobs
+            SET cancel_requested = TRUE,
+                status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE status END,
+                updated_at = NOW()
+            WHERE jobID = %s AND userID = %s AND status IN %s
+        """, (job_id, user_id, ACTIVE_JOB_STATUSES))
+        cancelled = cur.rowcount > 0
+    return cancelled
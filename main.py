@@ -1,52 +1,122 @@
-import psycopg2
+import time
+# Taken before the other imports so the warm-up timings include them.
+SCRIPT_STARTED = time.perf_counter()
+
+import hashlib
+import json
 import streamlit as st
-import bcrypt
-import uuid
-
-def connect_db():
-    return psycopg2.connect(
-        dbname="flashcards",
-        user="postgres",
-        password="password",
-        host="localhost",
-        port="5432"
+import streamlit.components.v1 as components
+from actions import pending_action_value, pending_like_delta, toggle_like
+from actions import toggle_published as queue_publish
+from db import (
+    ACTIVE_JOB_STATUSES, add_flashcard_to_set, add_user, cancel_job, check_if_set_is_published,
+    create_flashcard_set, delete_flashcard, enqueue_job, get_flashcards_in_set, get_liked_set_ids,
+    get_progress, get_published_flashcard_sets, get_published_like_counts,
+    get_recommended_sets_by_subject_and_likes, get_subject_set_counts, get_subjects,
+    get_top_sets_in_subject, get_user_flashcard_sets, get_user_info,
+    get_user_jobs, increment_progress, initialize_progress, login_user, reset_progress,
+    search_published_sets, update_flashcard
+)
+from rendering import CARD_STYLES, render_card_html
+from state_store import SESSION_TTL, create_session, end_session, get_session_user, get_store
+from study_packs import apply_study_results, get_study_pack, render_study_viewer
+import warmup
+
+# The data layer lives in db.py, actions.py and study_packs.py, which Python
+# imports once per process. Streamlit only re-executes this file, the UI, on
+# every rerun.
+
+# ----- CARD RENDERING -----
+def inject_card_styles():
+    # Streamlit drops any element that is not re-emitted on a rerun, so the
+    # stylesheet goes out once per run rather than once per card.
+    st.markdown(CARD_STYLES, unsafe_allow_html=True)
+
+def show_card(card_id, text, css_class):
+    st.markdown(
+        f"<div class='qf-card {css_class}'>{render_card_html(card_id, text)}</div>",
+        unsafe_allow_html=True
     )
 
-# ----- PASSWORD UTILITIES -----
-def hash_password(password):
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
-
-def check_password(password, hashed):
-    return bcrypt.checkpw(password.encode(), hashed.encode())
-
-# ----- DATABASE OPERATIONS -----
-def add_user(username, email, password):
-    conn = connect_db()
-    cur = conn.cursor()
-    hashed_pw = hash_password(password)
-    try:
-        cur.execute("INSERT INTO users (username, email, password_hash) VALUES (%s, %s, %s)",
-                    (username, email, hashed_pw))
-        conn.commit()
-        return True
-    except Exception as e:
-        st.error(f"Error: {e}")
-        return False
-    finally:
-        conn.close()
-
-def login_user(email, password):
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("SELECT userID, password_hash FROM users WHERE email = %s", (email,))
-    user = cur.fetchone()
-    conn.close()
-
-    if user and check_password(password, user[1]):
-        return user[0]  
-    else:
-        return None
+# ----- SHARED STATE -----
+# Login sessions and the review/viewer position live in the shared state store
+# (see state_store.py) instead of only in st.session_state, so any Streamlit
+# process can pick up a session and restarts do not log everyone out. The
+# session token travels in a cookie rather than the URL, so shared links and
+# browser history never carry it.
+PERSISTED_STATE_KEYS = (
+    "viewing_set_id", "current_card", "show_answer",
+    "review_set_id", "review_queue", "review_index", "review_show_answer",
+    "active_set"
+)
+
+SESSION_COOKIE = "quickflash_session"
+SESSION_COOKIE_MAX_AGE = 7 * 24 * 3600
+
+def set_session_cookie(token, max_age=SESSION_COOKIE_MAX_AGE):
+    # Streamlit can read cookies but not set them, so a zero-height component
+    # sets it on the page; the iframe shares the app's origin.
+    cookie = f"{SESSION_COOKIE}={token}; path=/; max-age={max_age}; SameSite=Strict"
+    components.html(f"""<script>
+        window.parent.document.cookie = {json.dumps(cookie)} +
+            (window.parent.location.protocol === "https:" ? "; Secure" : "");
+    </script>""", height=0)
+
+def start_session(user_id):
+    token = create_session(user_id)
+    st.session_state["user_id"] = user_id
+    st.session_state["session_token"] = token
+    set_session_cookie(token)
+
+def end_current_session():
+    if "session_token" in st.session_state:
+        end_session(st.session_state["session_token"])
+    st.session_state.clear()
+    # Cleared on the next run, since logging out reruns straight away.
+    st.session_state["clear_session_cookie"] = True
+
+def restore_session_state():
+    if st.session_state.pop("clear_session_cookie", False):
+        set_session_cookie("", max_age=0)
+    if "session" in st.query_params:
+        # Older links carried the token in the URL; it is no longer honoured.
+        del st.query_params["session"]
+
+    token = st.session_state.get("session_token")
+    if token:
+        # Checked on every run so an idle session expires here too, and so
+        # that activity keeps it alive.
+        if get_session_user(token) is None:
+            st.session_state.clear()
+        return
 
+    token = st.context.cookies.get(SESSION_COOKIE)
+    if not token:
+        return
+    user_id = get_session_user(token)
+    if user_id is None:
+        set_session_cookie("", max_age=0)
+        return
+    st.session_state["user_id"] = user_id
+    st.session_state["session_token"] = token
+    for key, value in (get_store().get(f"session_state:{token}") or {}).items():
+        st.session_state.setdefault(key, value)
+
+def persist_session_state():
+    token = st.session_state.get("session_token")
+    if not token:
+        return
+    # Round-trip through JSON so the snapshot is a copy: the review queue is
+    # mutated in place and would otherwise always compare equal.
+    state = json.loads(json.dumps(
+        {key: st.session_state[key] for key in PERSISTED_STATE_KEYS if key in st.session_state}
+    ))
+    # Only write when something changed; most reruns leave this untouched.
+    if state != st.session_state.get("persisted_state"):
+        get_store().set(f"session_state:{token}", state, ttl=SESSION_TTL)
+        st.session_state["persisted_state"] = state
+
+# ----- PAGES -----
 def show_login():
     st.subheader("🔐 Log In")
     email = st.text_input("Email")
@@ -55,7 +125,7 @@ def show_login():
         user_id = login_user(email, password)
         if user_id:
             st.success("Logged in successfully!")
-            st.session_state['user_id'] = user_id
+            start_session(user_id)
         else:
             st.error("Invalid credentials")
 
@@ -65,120 +135,13 @@ def show_signup():
     email = st.text_input("Email")
     password = st.text_input("Password", type="password")
     if st.button("Sign Up"):
-        if add_user(username, email, password):
-            st.success("Account created! Please log in.")
-        else:
+        try:
+            add_user(username, email, password)
+        except Exception as e:
+            st.error(f"Error: {e}")
             st.error("Failed to create account. Maybe email is already used?")
-
-def get_user_info(user_id):
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("SELECT username, email FROM users WHERE userID = %s", (user_id,))
-    user = cur.fetchone()
-    conn.close()
-    return user if user else ("Unknown", "Unknown")
-
-def create_flashcard_set(user_id, title, subject_id):
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO flashcardset (title, userID, subjectID)
-        VALUES (%s, %s, %s) RETURNING setID;
-    """, (title, user_id, subject_id))
-    set_id = cur.fetchone()[0]
-    conn.commit()
-    conn.close()
-    return set_id
-
-def get_user_flashcard_sets(user_id):
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT flashcardset.setID, flashcardset.title, subject.name
-        FROM flashcardset
-        JOIN subject ON flashcardset.subjectID = subject.subjectID
-        WHERE flashcardset.userID = %s;
-    """, (user_id,))
-    sets = cur.fetchall()
-    conn.close()
-    return sets
-
-def get_flashcards_in_set(set_id):
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT flashcard.cardID, flashcard.question, flashcard.answer
-        FROM flashcard
-        JOIN contains ON flashcard.cardID = contains.cardID
-        WHERE contains.setID = %s;
-    """, (set_id,))
-    flashcards = cur.fetchall()
-    conn.close()
-    return flashcards
-
-def add_flashcard_to_set(set_id, question, answer):
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO flashcard (question, answer)
-        VALUES (%s, %s) RETURNING cardID;
-    """, (question, answer))
-    card_id = cur.fetchone()[0]
-    cur.execute("""
-        INSERT INTO contains (cardID, setID)
-        VALUES (%s, %s);
-    """, (card_id, set_id))
-    conn.commit()
-    conn.close()
-    return card_id
-
-def update_flashcard(card_id, question, answer):
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("""
-        UPDATE flashcard
-        SET question = %s, answer = %s
-        WHERE cardID = %s;
-    """, (question, answer, card_id))
-    conn.commit()
-    conn.close()
-
-def delete_flashcard(card_id):
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM contains WHERE cardID = %s;", (card_id,))
-    cur.execute("DELETE FROM flashcard WHERE cardID = %s;", (card_id,))
-    conn.commit()
-    conn.close()
-
-def get_published_flashcard_sets():
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT flashcardset.setID, flashcardset.title, subject.name, users.username
-        FROM flashcardset
-        JOIN subject ON flashcardset.subjectID = subject.subjectID
-        JOIN users ON flashcardset.userID = users.userID
-        WHERE flashcardset.published = TRUE;
-    """)
-    sets = cur.fetchall()
-    conn.close()
-    return sets
-
-def set_flashcardset_published(set_id, published=True):
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("UPDATE flashcardset SET published = %s WHERE setID = %s", (published, set_id))
-    conn.commit()
-    conn.close()
-
-def check_if_set_is_published(set_id):
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("SELECT published FROM flashcardset WHERE setID = %s", (set_id,))
-    result = cur.fetchone()
-    conn.close()
-    return result[0] if result else False
+        else:
+            st.success("Account created! Please log in.")
 
 def show_flashcard_viewer():
     set_id = st.session_state["viewing_set_id"]
@@ -192,26 +155,20 @@ def show_flashcard_viewer():
         return
 
     idx = st.session_state.get("current_card", 0)
+    # A restored position can point past the end if cards were deleted since.
+    if not isinstance(idx, int) or not 0 <= idx < len(cards):
+        idx = st.session_state["current_card"] = 0
     card = cards[idx]
     question, answer = card[1], card[2]
 
     st.markdown("## 🃏 Flashcard Viewer")
 
+    inject_card_styles()
     with st.container():
-        st.markdown(
-            f"""
-            <div style='background-color:#f9f9f9;
-                        padding:50px;
-                        text-align:center;
-                        border-radius:12px;
-                        box-shadow:2px 2px 10px rgba(0,0,0,0.1);
-                        font-size:24px;
-                        min-height:200px;
-                        color:#222;'>
-                {answer if st.session_state.get("show_answer", False) else question}
-            </div>
-            """,
-            unsafe_allow_html=True
+        show_card(
+            card[0],
+            answer if st.session_state.get("show_answer", False) else question,
+            "qf-viewer-card"
         )
 
     st.markdown("")
@@ -253,6 +210,12 @@ def show_review_flashcards():
         initialize_progress(user_id, set_id, len(cards))
 
     queue = st.session_state["review_queue"]
+    # The queue may have been restored from an earlier session, so drop cards
+    # that have been deleted since and pick up edits to the rest.
+    current_cards = {card[0]: card for card in cards}
+    queue[:] = [current_cards[card[0]] for card in queue if card[0] in current_cards]
+    if not 0 <= st.session_state.get("review_index", 0) < len(queue):
+        st.session_state["review_index"] = 0
 
     if not queue:
         st.success("🎉 You've completed this set!")
@@ -277,32 +240,11 @@ def show_review_flashcards():
     st.markdown(f"**Progress:** {completed} / {total}")
 
     
-    st.markdown("""
-        <style>
-        @import url('https://fonts.googleapis.com/css2?family=Roboto+Slab&display=swap');
-        .review-card {
-            font-family: 'Roboto Slab', serif;
-        }
-        </style>
-    """, unsafe_allow_html=True)
-
-    st.markdown(
-        f"""
-        <div class='review-card' style='
-            background-color:#fff;
-            padding:60px;
-            text-align:center;
-            border-radius:14px;
-            font-size:30px;
-            color:#222;
-            box-shadow: 0 4px 12px rgba(0,0,0,0.1);
-            min-height:220px;
-            margin-bottom: 20px;
-        '>
-            {answer if st.session_state.get("review_show_answer", False) else question}
-        </div>
-        """,
-        unsafe_allow_html=True
+    inject_card_styles()
+    show_card(
+        card_id,
+        answer if st.session_state.get("review_show_answer", False) else question,
+        "qf-review-card"
     )
 
     col1, col2, col3 = st.columns(3)
@@ -333,222 +275,98 @@ def show_review_flashcards():
         del st.session_state["review_show_answer"]
         st.rerun()
 
-def initialize_progress(user_id, set_id, total_cards):
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO progress (userID, setID, completed_cards, total_cards)
-        VALUES (%s, %s, 0, %s)
-        ON CONFLICT (userID, setID) DO NOTHING;
-    """, (user_id, set_id, total_cards))
-    conn.commit()
-    conn.close()
-
-def get_progress(user_id, set_id):
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT completed_cards, total_cards FROM progress
-        WHERE userID = %s AND setID = %s;
-    """, (user_id, set_id))
-    result = cur.fetchone()
-    conn.close()
-    return result if result else (0, 0)
-
-def increment_progress(user_id, set_id):
-    conn = connect_db()
-    cur = conn.cursor()
-
-    
-    cur.execute("""
-        UPDATE progress
-        SET completed_cards = completed_cards + 1
-        WHERE userID = %s AND setID = %s AND completed_cards < total_cards;
-    """, (user_id, set_id))
-    
-    conn.commit()
-    conn.close()
-
-def reset_progress(user_id, set_id):
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("""
-        UPDATE progress
-        SET completed_cards = 0
-        WHERE userID = %s AND setID = %s;
-    """, (user_id, set_id))
-    conn.commit()
-    conn.close()
-
-def copy_flashcard_set(original_set_id, new_owner_id):
-    conn = connect_db()
-    cur = conn.cursor()
-
-    
-    cur.execute("""
-        SELECT title, subjectID FROM flashcardset WHERE setID = %s
-    """, (original_set_id,))
-    original = cur.fetchone()
-
-    if not original:
-        conn.close()
-        return None
-
-    title, subject_id = original
-    new_title = f"{title} (Copy)"
-
-    
-    cur.execute("""
-        INSERT INTO flashcardset (title, userID, subjectID, published)
-        VALUES (%s, %s, %s, FALSE)
-        RETURNING setID
-    """, (new_title, new_owner_id, subject_id))
-    new_set_id = cur.fetchone()[0]
-
-    
-    cur.execute("""
-        SELECT flashcard.question, flashcard.answer
-        FROM flashcard
-        JOIN contains ON flashcard.cardID = contains.cardID
-        WHERE contains.setID = %s
-    """, (original_set_id,))
-    cards = cur.fetchall()
-
-    
-    for question, answer in cards:
-        cur.execute("""
-            INSERT INTO flashcard (question, answer)
-            VALUES (%s, %s)
-            RETURNING cardID
-        """, (question, answer))
-        new_card_id = cur.fetchone()[0]
-
-        cur.execute("""
-            INSERT INTO contains (cardID, setID)
-            VALUES (%s, %s)
-        """, (new_card_id, new_set_id))
-    
-
-    conn.commit()
-    conn.close()
-
-    return new_set_id
-
-def delete_flashcard_set(set_id, user_id):
-    conn = connect_db()
-    cur = conn.cursor()
-
-    
-    cur.execute("SELECT setID FROM flashcardset WHERE setID = %s AND userID = %s", (set_id, user_id))
-    if not cur.fetchone():
-        conn.close()
-        return False  
-    
-    cur.execute("DELETE FROM contains WHERE setID = %s", (set_id,))
-
-    
-    cur.execute("""
-        DELETE FROM flashcard
-        WHERE cardID IN (
-            SELECT f.cardID
-            FROM flashcard f
-            LEFT JOIN contains c ON f.cardID = c.cardID
-            WHERE c.setID IS NULL
+# ----- QUEUED ACTIONS -----
+def toggle_published(set_id, published, title=None):
+    queue_publish(set_id, published)
+    if title:
+        st.toast(f"Set '{title}' is now {'public!' if published else 'private.'}")
+
+# ----- BACKGROUND JOBS -----
+def queue_copy(set_id, user_id, title=None):
+    enqueue_job("copy_set", user_id, {"set_id": set_id})
+    st.toast(f"Copying '{title}' in the background." if title else "Copy queued.")
+
+def queue_delete(set_id, user_id, title=None):
+    enqueue_job("delete_set", user_id, {"set_id": set_id})
+    if st.session_state.get("active_set", {}).get("id") == set_id:
+        del st.session_state["active_set"]
+    st.toast(f"Deleting '{title}' in the background." if title else "Delete queued.")
+
+def describe_job(kind, payload, result):
+    if kind == "copy_set":
+        if result and result.get("new_set_id"):
+            return f"Copy of set {payload['set_id']} → set {result['new_set_id']}"
+        return f"Copy of set {payload['set_id']}"
+    if kind == "delete_set":
+        return f"Delete set {payload['set_id']}"
+    return kind
+
+def show_jobs(user_id):
+    jobs = get_user_jobs(user_id)
+    if not jobs:
+        return
+    with st.sidebar.expander("⏳ Background Jobs", expanded=any(job[3] in ACTIVE_JOB_STATUSES for job in jobs)):
+        for job_id, kind, payload, status, progress, total, result, error in jobs:
+            st.markdown(f"**{describe_job(kind, payload, result)}** — {status}")
+            if status == "running" and total:
+                st.progress(progress / total)
+            if status == "failed" and error:
+                st.caption(error)
+            if status in ACTIVE_JOB_STATUSES:
+                st.button("✖️ Cancel", key=f"cancel_job_{job_id}", on_click=cancel_job, args=(job_id, user_id))
+        st.button("🔄 Refresh", key="refresh_jobs")
+
+def get_pending_delete_set_ids(user_id):
+    return {
+        payload["set_id"]
+        for _, kind, payload, status, *_ in get_user_jobs(user_id, limit=50)
+        if kind == "delete_set" and status in ACTIVE_JOB_STATUSES
+    }
+
+# ----- STUDY PACKS -----
+def show_study_pack(user_id, set_id):
+    pack = get_study_pack(set_id)
+    st.caption(f"Pack v{pack['version']} · {len(pack['card_ids'])} cards · checksum {pack['checksum'][:12]}")
+    components.html(render_study_viewer(pack), height=420, scrolling=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            "💾 Download offline pack",
+            render_study_viewer(pack),
+            file_name=f"quickflash-{set_id}.html",
+            mime="text/html",
+            key=f"pack_html_{set_id}"
+        )
+    with col2:
+        st.download_button(
+            "📦 Download data bundle",
+            pack["gzip"],
+            file_name=f"quickflash-{set_id}-v{pack['version']}.json.gz",
+            mime="application/gzip",
+            key=f"pack_gz_{set_id}"
         )
-    """)
-
-    
-    cur.execute("DELETE FROM progress WHERE setID = %s AND userID = %s", (set_id, user_id))
 
-    
-    cur.execute("DELETE FROM flashcardset WHERE setID = %s", (set_id,))
-
-    conn.commit()
-    conn.close()
-    return True
-
-def get_recommended_sets_by_subject_and_likes(user_id, limit=5):
-    conn = connect_db()
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT f.setID, f.title, s.name AS subject, u.username,
-            (
-                SELECT COUNT(*) FROM likes l WHERE l.setID = f.setID
-            ) AS like_count
-        FROM flashcardset f
-        JOIN subject s ON f.subjectID = s.subjectID
-        JOIN users u ON f.userID = u.userID
-        WHERE f.published = TRUE
-          AND f.userID != %s
-          AND f.subjectID IN (
-              SELECT DISTINCT subjectID FROM flashcardset
-              WHERE userID = %s
-          )
-        ORDER BY like_count DESC
-        LIMIT %s;
-    """, (user_id, user_id, limit))
-
-    sets = cur.fetchall()
-    conn.close()
-    return sets
-
-def like_flashcard_set(user_id, set_id):
-    conn = connect_db()
-    cur = conn.cursor()
+    uploaded = st.file_uploader("Upload study results", type="json", key=f"pack_results_{set_id}")
+    if uploaded is None:
+        return
+    # The uploader hands back the same file on every rerun, so each upload is
+    # applied once; otherwise it would undo a progress reset straight away.
+    upload_id = hashlib.sha256(uploaded.getvalue()).hexdigest()
+    if st.session_state.get(f"applied_results_{set_id}") == upload_id:
+        return
+    st.session_state[f"applied_results_{set_id}"] = upload_id
     try:
-        cur.execute("""
-            INSERT INTO likes (userID, setID)
-            VALUES (%s, %s)
-            ON CONFLICT DO NOTHING;
-        """, (user_id, set_id))
-        conn.commit()
-    finally:
-        conn.close()
-
-def unlike_flashcard_set(user_id, set_id):
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM likes WHERE userID = %s AND setID = %s", (user_id, set_id))
-    conn.commit()
-    conn.close()
-
-def has_liked_set(user_id, set_id):
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("SELECT 1 FROM likes WHERE userID = %s AND setID = %s", (user_id, set_id))
-    result = cur.fetchone()
-    conn.close()
-    return bool(result)
-
-def get_set_likes(set_id):
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM likes WHERE setID = %s", (set_id,))
-    count = cur.fetchone()[0]
-    conn.close()
-    return count
-
-def search_published_sets(query):
-    conn = connect_db()
-    cur = conn.cursor()
-
-    like_query = f"%{query.lower()}%"
-    cur.execute("""
-        SELECT f.setID, f.title, s.name AS subject, u.username
-        FROM flashcardset f
-        JOIN subject s ON f.subjectID = s.subjectID
-        JOIN users u ON f.userID = u.userID
-        WHERE f.published = TRUE
-          AND (
-              LOWER(f.title) LIKE %s
-              OR LOWER(s.name) LIKE %s
-          )
-    """, (like_query, like_query))
-
-    results = cur.fetchall()
-    conn.close()
-    return results
+        results = json.loads(uploaded.getvalue())
+    except ValueError:
+        st.error("That file is not a valid results file.")
+        return
+    try:
+        counted = apply_study_results(user_id, set_id, results)
+    except ValueError as e:
+        st.error(str(e))
+        return
+    st.success(f"Recorded {counted} completed cards.")
 
 def main():
     st.title("📚 QuickFlash")
@@ -566,9 +384,10 @@ def main():
     if 'user_id' in st.session_state:
         username, email = get_user_info(st.session_state['user_id'])
         st.sidebar.markdown(f"👤 **Logged in as:** {username} ({email})")
+        show_jobs(st.session_state['user_id'])
     
     if st.sidebar.button("🚪 Log Out"):
-        st.session_state.clear()
+        end_current_session()
         st.rerun()
 
     if choice == "Login":
@@ -587,11 +406,7 @@ def main():
                 title = st.text_input("Set Title")
             
             
-                conn = connect_db()
-                cur = conn.cursor()
-                cur.execute("SELECT subjectID, name FROM subject")
-                subjects = cur.fetchall()
-                conn.close()
+                subjects = get_subjects()
 
                 subject_names = {name: sid for sid, name in subjects}
                 subject_choice = st.selectbox("Subject", list(subject_names.keys()))
@@ -606,7 +421,8 @@ def main():
                         st.success(f"Set '{title}' created! (ID: {new_set_id})")
                         st.rerun()  
             st.markdown("### 📁 Your Sets")
-            sets = get_user_flashcard_sets(st.session_state['user_id'])
+            deleting = get_pending_delete_set_ids(st.session_state['user_id'])
+            sets = [row for row in get_user_flashcard_sets(st.session_state['user_id']) if row[0] not in deleting]
             if sets:
                 for set_id, title, subject_name in sets:
                     col1, col2, col3 = st.columns([2, 1, 2])  
@@ -620,25 +436,17 @@ def main():
                             st.rerun()
 
                     with col2:
-                        if st.button(f"🗑️ Delete", key=f"del_set_{set_id}"):
-                            if delete_flashcard_set(set_id, st.session_state["user_id"]):
-                                st.success(f"Set '{title}' deleted.")
-                                st.rerun()
-                            else:
-                                st.error("Failed to delete the set or unauthorized.")
+                        st.button(f"🗑️ Delete", key=f"del_set_{set_id}",
+                                  on_click=queue_delete, args=(set_id, st.session_state["user_id"], title))
 
                     with col3:
-                        is_published = check_if_set_is_published(set_id)
+                        is_published = pending_action_value("publish", None, set_id, check_if_set_is_published(set_id))
                         if is_published:
-                            if st.button(f"📤 Unpublish '{title}'", key=f"unpub_{set_id}"):
-                                set_flashcardset_published(set_id, False)
-                                st.success(f"Set '{title}' is now private.")
-                                st.rerun()
+                            st.button(f"📤 Unpublish '{title}'", key=f"unpub_{set_id}",
+                                      on_click=toggle_published, args=(set_id, False, title))
                         else:
-                            if st.button(f"🌍 Publish '{title}'", key=f"pub_{set_id}"):
-                                set_flashcardset_published(set_id, True)
-                                st.success(f"Set '{title}' is now public!")
-                                st.rerun()
+                            st.button(f"🌍 Publish '{title}'", key=f"pub_{set_id}",
+                                      on_click=toggle_published, args=(set_id, True, title))
                 if 'active_set' in st.session_state:
                     set_info = st.session_state['active_set']
                     st.markdown(f"## ✏️ Editing Set: **{set_info['title']}**")
@@ -707,6 +515,10 @@ def main():
                 st.session_state["review_show_answer"] = False
                 st.rerun()
 
+            if set_choice:
+                with st.expander("📴 Study Offline"):
+                    show_study_pack(st.session_state["user_id"], set_titles[set_choice])
+
 # Review Session(NO LONGER USED)
     if 'review_cards' in st.session_state and st.session_state['review_cards']:
         index = st.session_state['review_index']
@@ -781,30 +593,55 @@ def main():
                             st.session_state["show_answer"] = False
                             st.rerun()
                     with col3:
-                        if st.button("📄 Copy", key=f"reco_copy_{set_id}"):
-                            new_id = copy_flashcard_set(set_id, user_id)
-                            st.success(f"Copied to My Sets (ID: {new_id})")
-                            st.rerun()
+                        st.button("📄 Copy", key=f"reco_copy_{set_id}",
+                                  on_click=queue_copy, args=(set_id, user_id, title))
+
+        st.markdown("---")
+        st.subheader("📚 Browse by Subject")
+
+        subject_counts = get_subject_set_counts()
+        browse_subjects = {
+            f"{name} ({subject_counts[subject_id]})": subject_id
+            for subject_id, name in get_subjects()
+            if subject_counts.get(subject_id)
+        }
+        if browse_subjects:
+            browse_choice = st.selectbox("Subject", list(browse_subjects.keys()), key="browse_subject")
+            for set_id, title, creator, like_count in get_top_sets_in_subject(browse_subjects[browse_choice]):
+                col1, col2 = st.columns([4, 1])
+                with col1:
+                    st.markdown(f"**📘 {title}** by *{creator}* — ❤️ {like_count}")
+                with col2:
+                    if st.button("🔍 View", key=f"subject_view_{set_id}"):
+                        st.session_state["viewing_set_id"] = set_id
+                        st.session_state["current_card"] = 0
+                        st.session_state["show_answer"] = False
+                        st.rerun()
+        else:
+            st.info("No published sets yet.")
 
         st.markdown("---")
         st.subheader("🌍 All Published Sets")
 
         all_sets = get_published_flashcard_sets()
+        if user_id:
+            liked_set_ids = get_liked_set_ids(user_id)
+            like_counts = get_published_like_counts()
         for set_id, title, subject, creator in all_sets:
             col1, col2, col3 = st.columns([3, 1, 1])
             with col1:
                 st.markdown(f"**📘 {title}** — {subject} by *{creator}*")
                 if user_id:
-                    like_count = get_set_likes(set_id)
-                    liked = has_liked_set(user_id, set_id)
+                    # Buttons queue the change in on_click, so this same run already
+                    # shows the new state; no second rerun or refetch is needed.
+                    like_count = like_counts.get(set_id, 0) + pending_like_delta(set_id)
+                    liked = pending_action_value("like", user_id, set_id, set_id in liked_set_ids)
                     if liked:
-                        if st.button("💔 Unlike", key=f"unlike_{set_id}"):
-                            unlike_flashcard_set(user_id, set_id)
-                            st.rerun()
+                        st.button("💔 Unlike", key=f"unlike_{set_id}",
+                                  on_click=toggle_like, args=(user_id, set_id, False))
                     else:
-                        if st.button("❤️ Like", key=f"like_{set_id}"):
-                            like_flashcard_set(user_id, set_id)
-                            st.rerun()
+                        st.button("❤️ Like", key=f"like_{set_id}",
+                                  on_click=toggle_like, args=(user_id, set_id, True))
                     st.markdown(f"👍 {like_count} likes")
 
             with col2:
@@ -816,11 +653,18 @@ def main():
 
             with col3:
                 if user_id:
-                    if st.button("📄 Copy", key=f"copy_{set_id}"):
-                        new_id = copy_flashcard_set(set_id, user_id)
-                        st.success(f"Copied to My Sets (ID: {new_id})")
-                        st.rerun()
+                    st.button("📄 Copy", key=f"copy_{set_id}",
+                              on_click=queue_copy, args=(set_id, user_id, title))
+
 
+def run():
+    warmup.start_background_warmup(SCRIPT_STARTED)
+    restore_session_state()
+    try:
+        main()
+    finally:
+        # st.rerun() ends the script by raising, so this has to run in finally.
+        persist_session_state()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run()
\ No newline at end of file
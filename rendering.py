@@ -0,0 +1,181 @@
+import functools
+import hashlib
+import html
+import importlib
+import re
+
+from state_store import get_store
+
+# Card HTML rendering, shared by the Streamlit pages and study packs. Markdown
+# and LaTeX support are optional and their packages are only imported the first
+# time a card is rendered, so pages that never show a card do not pay for them.
+# Both need nh3 to sanitize their output; without it cards are plain text.
+
+# Roboto Slab is used where it is installed locally and the review page falls
+# back to the browser's serif font otherwise; nothing is fetched from Google
+# Fonts or anywhere else.
+CARD_STYLES = """
+<style>
+@font-face {
+    font-family: 'Roboto Slab';
+    src: local('Roboto Slab'), local('RobotoSlab-Regular');
+    font-display: swap;
+}
+.qf-card {
+    text-align:center;
+    color:#222;
+}
+.qf-viewer-card {
+    background-color:#f9f9f9;
+    padding:50px;
+    border-radius:12px;
+    box-shadow:2px 2px 10px rgba(0,0,0,0.1);
+    font-size:24px;
+    min-height:200px;
+}
+.qf-review-card {
+    font-family: 'Roboto Slab', serif;
+    background-color:#fff;
+    padding:60px;
+    border-radius:14px;
+    font-size:30px;
+    box-shadow: 0 4px 12px rgba(0,0,0,0.1);
+    min-height:220px;
+    margin-bottom: 20px;
+}
+</style>
+"""
+
+# $$display$$ and $inline$ math. Delimiters escaped as \$ do not count, and the
+# content may not start or end with a space, so "costs $5 and $10" stays text.
+MATH_PATTERN = re.compile(
+    r"(?<!\\)\$\$(?=\S)(.+?)(?<=\S)(?<!\\)\$\$"
+    r"|(?<![\\$\w])\$(?=[^\s$])([^$\n]*?[^\s\\$])\$(?![\w$])",
+    re.DOTALL
+)
+
+# Everything Markdown and latex2mathml produce is run through nh3 with this
+# allowlist before it reaches the page: card text is user input, and neither
+# library escapes all of it (latex2mathml copies \\text{...} through verbatim,
+# and Markdown links can use any scheme).
+SAFE_TAGS = {
+    "p", "br", "hr", "em", "strong", "code", "pre", "blockquote",
+    "ul", "ol", "li", "a", "img", "h1", "h2", "h3", "h4", "h5", "h6",
+    "math", "semantics", "annotation", "mrow", "mi", "mn", "mo", "ms", "mtext",
+    "mspace", "mfrac", "msqrt", "mroot", "msub", "msup", "msubsup", "munder",
+    "mover", "munderover", "mtable", "mtr", "mtd", "mstyle", "mpadded",
+    "mphantom", "menclose", "merror", "mmultiscripts", "mprescripts", "none"
+}
+SAFE_ATTRIBUTES = {
+    "a": {"href", "title"},
+    "img": {"src", "alt", "title"},
+    "math": {"display", "xmlns"},
+    "annotation": {"encoding"},
+    "mo": {"stretchy", "fence", "separator", "lspace", "rspace", "form", "largeop",
+           "movablelimits", "symmetric", "minsize", "maxsize"},
+    "mover": {"accent"},
+    "munder": {"accentunder"},
+    "munderover": {"accent", "accentunder"},
+    "mfrac": {"linethickness"},
+    "mspace": {"width", "height", "depth"},
+    "mpadded": {"width", "height", "depth", "lspace", "voffset"},
+    "menclose": {"notation"},
+    "mtable": {"columnalign", "rowspacing", "columnspacing", "displaystyle"},
+    "mtd": {"columnalign"},
+    "mstyle": {"displaystyle", "scriptlevel", "mathvariant"},
+    "*": {"mathvariant"}
+}
+SAFE_URL_SCHEMES = {"http", "https", "mailto"}
+URL_SCHEME_PATTERN = re.compile(r"^([a-z][a-z0-9+.\-]*):", re.IGNORECASE)
+
+optional_modules = {}
+
+def load_optional(name):
+    if name not in optional_modules:
+        try:
+            optional_modules[name] = importlib.import_module(name)
+        except ImportError:
+            optional_modules[name] = None
+    return optional_modules[name]
+
+def render_math(tex, display):
+    latex2mathml = load_optional("latex2mathml.converter")
+    source = html.escape(f"$${tex}$$" if display else f"${tex}$")
+    if latex2mathml is None:
+        return source
+    try:
+        return latex2mathml.convert(tex, display="block" if display else "inline")
+    except Exception:
+        # Card text is user input, so malformed LaTeX is shown as written.
+        return source
+
+def render_markdown(markdown, text):
+    # Raw HTML in card text is shown as written ("what does <div> do?") rather
+    # than interpreted.
+    md = markdown.Markdown()
+    md.preprocessors.deregister("html_block")
+    md.inlinePatterns.deregister("html")
+    return md.convert(text)
+
+def filter_attribute(tag, attribute, value):
+    # nh3 reads "java\tscript:" as a relative URL, but browsers drop tabs,
+    # newlines and leading spaces from URLs, so the scheme is checked again
+    # the way a browser would see it.
+    if attribute in ("href", "src"):
+        scheme = URL_SCHEME_PATTERN.match(re.sub(r"[\x00-\x20]", "", value))
+        if scheme and scheme.group(1).lower() not in SAFE_URL_SCHEMES:
+            return None
+    return value
+
+def sanitize_html(body):
+    nh3 = load_optional("nh3")
+    return nh3.clean(
+        body, tags=SAFE_TAGS, attributes=SAFE_ATTRIBUTES,
+        url_schemes=SAFE_URL_SCHEMES, attribute_filter=filter_attribute
+    )
+
+# Rendered HTML is kept in the shared state store under a hash of the card text,
+# so a card is rendered once (normally when it is saved, by prerender_card, even
+# in a worker process) and every process reuses it. Bump RENDER_VERSION when the
+# output changes.
+RENDER_VERSION = 1
+CARD_HTML_TTL = 30 * 24 * 3600
+
+@functools.lru_cache(maxsize=2000)
+def render_card_html(card_id, text):
+    mode = "rich" if load_optional("nh3") is not None else "plain"
+    key = f"card_html:{RENDER_VERSION}:{mode}:{hashlib.sha256(text.encode()).hexdigest()}"
+    body = get_store().get(key)
+    if body is None:
+        body = build_card_html(text)
+        get_store().set(key, body, ttl=CARD_HTML_TTL)
+    return body
+
+def build_card_html(text):
+    # Without nh3 nothing rendered can be trusted, so the card is shown as
+    # escaped plain text.
+    if load_optional("nh3") is None:
+        return html.escape(text).replace("\n", "<br>")
+
+    # Math is pulled out first so Markdown does not mangle it, then swapped back in.
+    math = []
+    def stash(match):
+        math.append(render_math(match.group(1) or match.group(2), match.group(1) is not None))
+        return f"\x00{len(math) - 1}\x00"
+    body = MATH_PATTERN.sub(stash, text).replace("\\$", "$")
+
+    markdown = load_optional("markdown")
+    if markdown is not None:
+        body = render_markdown(markdown, body)
+    else:
+        body = html.escape(body).replace("\n", "<br>")
+
+    for i, rendered in enumerate(math):
+        body = body.replace(f"\x00{i}\x00", rendered)
+    return sanitize_html(body)
+
+def prerender_card(card_id, question, answer):
+    # Called as cards are saved, so their HTML is in the shared store before
+    # anyone views them.
+    render_card_html(card_id, question)
+    render_card_html(card_id, answer)
@@ -0,0 +1,250 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Shared key/value store for state that has to outlive one Streamlit process:
+# login sessions, review progress and hot read caches. Pick a backend with
+# QUICKFLASH_STATE_URL:
+#   memory://                   one process only, lost on restart
+#   sqlite:///path/to/state.db  shared by every process on this machine (default)
+#   redis://host:6379/0         shared across machines
+# Values are stored as JSON.
+
+# A relative SQLite path is taken from this directory rather than the working
+# directory, so the app, the API and the workers find the same file however
+# they are started.
+DEFAULT_STATE_URL = "sqlite:///.quickflash_state.db"
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Expired entries are only dropped when read, so the memory and SQLite stores
+# also sweep them out this often; otherwise idempotency keys and abandoned
+# sessions would pile up. Redis expires keys itself.
+PURGE_INTERVAL = 300
+
+# Sessions end after SESSION_TTL seconds without activity. Each use pushes the
+# expiry back, at most once every SESSION_RENEW_SECONDS to spare the store.
+SESSION_TTL = 30 * 60
+SESSION_RENEW_SECONDS = 60
+
+class MemoryStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+        self.purged_at = time.time()
+
+    def purge_expired(self):
+        # Called with the lock held.
+        now = time.time()
+        if now - self.purged_at < PURGE_INTERVAL:
+            return
+        self.purged_at = now
+        for key, (_, expires) in list(self.data.items()):
+            if expires is not None and expires < now:
+                del self.data[key]
+
+    def get(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                del self.data[key]
+                return None
+            return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.purge_expired()
+            self.data[key] = (json.dumps(value), time.time() + ttl if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        # Sets key only if it is absent or expired; True if it was set.
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is not None and (entry[1] is None or entry[1] >= time.time()):
+                return False
+            self.data[key] = (json.dumps(value), time.time() + ttl if ttl else None)
+            return True
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def incr(self, key):
+        with self.lock:
+            value, expires = self.data.get(key, ("0", None))
+            value = json.loads(value) + 1
+            self.data[key] = (json.dumps(value), expires)
+            return value
+
+class SQLiteStore:
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.purged_at = 0
+        conn = self.connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS state_expires_idx ON state (expires)")
+        conn.commit()
+
+    def purge_expired(self, conn):
+        now = time.time()
+        if now - self.purged_at < PURGE_INTERVAL:
+            return
+        self.purged_at = now
+        conn.execute("DELETE FROM state WHERE expires IS NOT NULL AND expires < ?", (now,))
+
+    def connect(self):
+        # sqlite3 connections cannot be shared between threads.
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self.connect().execute(
+            "SELECT value, expires FROM state WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] < time.time():
+            self.delete(key)
+            return None
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        conn = self.connect()
+        self.purge_expired(conn)
+        conn.execute(
+            "INSERT OR REPLACE INTO state (key, value, expires) VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + ttl if ttl else None)
+        )
+        conn.commit()
+
+    def add(self, key, value, ttl=None):
+        now = time.time()
+        conn = self.connect()
+        with conn:
+            cursor = conn.execute("""
+                INSERT INTO state (key, value, expires) VALUES (?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires = excluded.expires
+                WHERE state.expires IS NOT NULL AND state.expires < ?
+            """, (key, json.dumps(value), now + ttl if ttl else None, now))
+            return cursor.rowcount == 1
+
+    def delete(self, key):
+        conn = self.connect()
+        conn.execute("DELETE FROM state WHERE key = ?", (key,))
+        conn.commit()
+
+    def incr(self, key):
+        conn = self.connect()
+        with conn:
+            conn.execute("""
+                INSERT INTO state (key, value) VALUES (?, '1')
+                ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+            """, (key,))
+            return int(conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()[0])
+
+class RedisStore:
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self.client.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, json.dumps(value), ex=ttl)
+
+    def add(self, key, value, ttl=None):
+        return bool(self.client.set(key, json.dumps(value), ex=ttl, nx=True))
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+def open_store(url=None):
+    url = url or os.environ.get("QUICKFLASH_STATE_URL", DEFAULT_STATE_URL)
+    if url.startswith("memory://"):
+        return MemoryStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteStore(os.path.join(APP_DIR, url[len("sqlite:///"):]))
+    if url.startswith(("redis://", "rediss://")):
+        if redis is None:
+            raise RuntimeError("QUICKFLASH_STATE_URL points at Redis but the redis package is not installed")
+        return RedisStore(url)
+    raise ValueError(f"Unsupported QUICKFLASH_STATE_URL: {url}")
+
+store = None
+store_lock = threading.Lock()
+
+def get_store():
+    # One store per process; this module is imported once, so the global
+    # survives Streamlit reruns.
+    global store
+    if store is None:
+        with store_lock:
+            if store is None:
+                store = open_store()
+    return store
+
+# ----- SESSIONS -----
+def create_session(user_id):
+    token = uuid.uuid4().hex
+    get_store().set(f"session:{token}", {"user_id": user_id, "renewed": time.time()}, ttl=SESSION_TTL)
+    return token
+
+def get_session_user(token):
+    session = get_store().get(f"session:{token}") if token else None
+    if not session:
+        return None
+    if time.time() - session.get("renewed", 0) > SESSION_RENEW_SECONDS:
+        session["renewed"] = time.time()
+        get_store().set(f"session:{token}", session, ttl=SESSION_TTL)
+        state = get_store().get(f"session_state:{token}")
+        if state is not None:
+            get_store().set(f"session_state:{token}", state, ttl=SESSION_TTL)
+    return session["user_id"]
+
+def end_session(token):
+    get_store().delete(f"session:{token}")
+    get_store().delete(f"session_state:{token}")
+
+# ----- CACHES -----
+def cached_read(key, ttl, loader):
+    value = get_store().get(f"cache:{key}")
+    if value is None:
+        value = loader()
+        get_store().set(f"cache:{key}", value, ttl=ttl)
+    return value
+
+def invalidate_cache(key):
+    get_store().delete(f"cache:{key}")
+
+def get_version(key):
+    return get_store().get(f"version:{key}") or 0
+
+def bump_version(key):
+    # Processes that keep their own copy of something compare versions to
+    # find out that another process has changed it.
+    return get_store().incr(f"version:{key}")
@@ -0,0 +1,154 @@
+import gzip
+import hashlib
+import json
+
+from db import db_cursor, get_flashcard_set_title, get_flashcards_in_set
+from rendering import CARD_STYLES, render_card_html
+from state_store import get_version
+
+# A study pack is a compressed snapshot of one set that a browser can review
+# without calling back to the server for every card. Packs are rebuilt lazily
+# when their set changes and keyed by a content checksum, which doubles as the
+# ETag for clients that already hold a copy.
+STUDY_PACK_FORMAT = 1
+
+# Built per process; a shared version per set (bumped by db.invalidate_study_pack)
+# tells every process when its copy is out of date.
+study_packs = {}
+
+STUDY_VIEWER_TEMPLATE = """
+<div id="qf-study"></div>
+<script id="qf-pack" type="application/json">__PACK__</script>
+<script>
+(function () {
+    const pack = JSON.parse(document.getElementById("qf-pack").textContent);
+    const storeKey = "quickflash-" + pack.set_id + "-" + pack.checksum;
+    const saved = JSON.parse(localStorage.getItem(storeKey) || "null");
+    let queue = saved ? saved.queue : pack.cards.map(c => c.id);
+    let done = saved ? saved.done : [];
+    let showAnswer = false;
+    const byId = Object.fromEntries(pack.cards.map(c => [c.id, c]));
+    const root = document.getElementById("qf-study");
+
+    function save() {
+        localStorage.setItem(storeKey, JSON.stringify({queue: queue, done: done}));
+    }
+
+    function results() {
+        return JSON.stringify({set_id: pack.set_id, checksum: pack.checksum, completed: done});
+    }
+
+    function render() {
+        root.innerHTML = "";
+        const progress = document.createElement("p");
+        progress.textContent = "Progress: " + done.length + " / " + pack.cards.length;
+        root.appendChild(progress);
+
+        if (!queue.length) {
+            const link = document.createElement("a");
+            link.textContent = "Download results";
+            link.download = "quickflash-results-" + pack.set_id + ".json";
+            link.href = "data:application/json," + encodeURIComponent(results());
+            root.appendChild(link);
+            return;
+        }
+
+        const card = byId[queue[0]];
+        const face = document.createElement("div");
+        face.className = "qf-card qf-review-card";
+        face.innerHTML = showAnswer ? card.answer : card.question;
+        root.appendChild(face);
+
+        [["Flip", () => { showAnswer = !showAnswer; }],
+         ["I got it", () => { done.push(queue.shift()); showAnswer = false; }],
+         ["I missed it", () => { queue.push(queue.shift()); showAnswer = false; }]
+        ].forEach(([label, action]) => {
+            const button = document.createElement("button");
+            button.textContent = label;
+            button.onclick = () => { action(); save(); render(); };
+            root.appendChild(button);
+        });
+    }
+
+    render();
+})();
+</script>
+"""
+
+def build_study_pack(set_id):
+    # Read the stamp before the cards so an edit that lands in between leaves
+    # this pack looking stale rather than current.
+    stamp = get_version(f"study_pack:{set_id}")
+    cards = get_flashcards_in_set(set_id)
+    payload = {
+        "format": STUDY_PACK_FORMAT,
+        "set_id": set_id,
+        "title": get_flashcard_set_title(set_id),
+        "cards": [
+            {
+                "id": card_id,
+                "position": position,
+                "question": render_card_html(card_id, question),
+                "answer": render_card_html(card_id, answer)
+            }
+            for position, (card_id, question, answer) in enumerate(cards)
+        ]
+    }
+    body = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    checksum = hashlib.sha256(body.encode()).hexdigest()
+
+    # The version shown to users comes from the shared stamp, so every process
+    # numbers the same content the same way and restarts do not reset it.
+    previous = study_packs.get(set_id)
+    if previous and previous["checksum"] == checksum:
+        previous.update(stamp=stamp, version=stamp + 1)
+        return previous
+
+    payload["checksum"] = checksum
+    pack = {
+        "version": stamp + 1,
+        "checksum": checksum,
+        "etag": f'"{checksum[:32]}"',
+        "card_ids": {card["id"] for card in payload["cards"]},
+        "payload": payload,
+        "gzip": gzip.compress(json.dumps(payload, separators=(",", ":")).encode()),
+        "stamp": stamp
+    }
+    study_packs[set_id] = pack
+    return pack
+
+def get_study_pack(set_id):
+    pack = study_packs.get(set_id)
+    if pack is None or pack["stamp"] != get_version(f"study_pack:{set_id}"):
+        pack = build_study_pack(set_id)
+    return pack
+
+def render_study_viewer(pack):
+    # "</" would end the script tag early, so it is escaped inside the JSON.
+    data = json.dumps(pack["payload"], separators=(",", ":")).replace("</", "<\\/")
+    return CARD_STYLES + STUDY_VIEWER_TEMPLATE.replace("__PACK__", data)
+
+def apply_study_results(user_id, set_id, results):
+    # Results come back from the browser in one batch, possibly from an older
+    # pack if the set was edited meanwhile, so only cards that still belong to
+    # the set are counted. Raises ValueError for malformed results.
+    if not isinstance(results, dict) or results.get("set_id") != set_id:
+        raise ValueError("Those results belong to a different set.")
+    completed = results.get("completed")
+    if not isinstance(completed, list) or not all(
+        isinstance(card_id, int) and not isinstance(card_id, bool) for card_id in completed
+    ):
+        raise ValueError("That file is not a valid results file.")
+    pack = get_study_pack(set_id)
+    completed = set(completed) & pack["card_ids"]
+    total = len(pack["card_ids"])
+
+    with db_cursor() as cur:
+        cur.execute("""
+            INSERT INTO progress (userID, setID, completed_cards, total_cards)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (userID, setID) DO UPDATE
+            SET completed_cards = GREATEST(progress.completed_cards, EXCLUDED.completed_cards),
+                total_cards = EXCLUDED.total_cards;
+        """, (user_id, set_id, min(len(completed), total), total))
+    return len(completed)
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The app modules live at the top of the repository rather than in a package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep rendered cards and other shared state out of the real state file.
+os.environ["QUICKFLASH_STATE_URL"] = "memory://"
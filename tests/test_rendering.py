@@ -0,0 +1,73 @@
+import pytest
+
+import rendering
+
+pytest.importorskip("nh3")
+pytest.importorskip("markdown")
+pytest.importorskip("latex2mathml")
+
+def render(text):
+    rendering.render_card_html.cache_clear()
+    return rendering.render_card_html(1, text)
+
+def test_mtext_cannot_inject_html():
+    body = render(r"$\text{<img/src/onerror=alert(1)>}$")
+    assert "<math" in body
+    assert "onerror" not in body
+
+def test_raw_html_is_shown_as_text():
+    body = render("What does <div> do? <script>alert(1)</script>")
+    assert "&lt;div&gt;" in body
+    assert "<script" not in body
+
+@pytest.mark.parametrize("url", [
+    "javascript:alert(1)", "JaVa\tscript:alert(1)", "java&#9;script:alert(1)", "&#106;avascript:alert(1)",
+    " javascript:x", "data:text/html,x", "vbscript:x"
+])
+def test_unsafe_link_schemes_are_dropped(url):
+    body = render(f"[click]({url})")
+    assert "href" not in body
+    assert "script:" not in body.lower().replace("\t", "")
+
+@pytest.mark.parametrize("url", ["https://example.com/?a=1&b=2", "/sets/1", "#top", "mailto:a@example.com"])
+def test_safe_links_are_kept(url):
+    body = render(f"[click]({url})")
+    assert 'href="' + url.replace("&", "&amp;") + '"' in body
+
+def test_code_spans_are_escaped_once():
+    assert "<code>a &lt; b &amp;&amp; c</code>" in render("Use `a < b && c` here")
+
+def test_blockquotes_are_rendered():
+    assert "<blockquote>" in render("> quote")
+
+def test_prices_are_not_math():
+    body = render("costs $5 and $10")
+    assert "<math" not in body
+    assert "costs $5 and $10" in body
+
+def test_math_is_rendered():
+    assert render("$x^2$").count("<math") == 1
+    assert 'display="block"' in render(r"$$\frac{a}{b}$$")
+
+def test_escaped_dollars_are_literal():
+    body = render(r"\$x\$")
+    assert "<math" not in body
+    assert "$x$" in body
+
+def test_malformed_latex_falls_back_to_text():
+    body = render(r"$\frac{$")
+    assert "<math" not in body
+
+def test_without_nh3_cards_are_plain_text(monkeypatch):
+    monkeypatch.setitem(rendering.optional_modules, "nh3", None)
+    body = render("**<b>hi</b>** $x$")
+    assert body == "**&lt;b&gt;hi&lt;/b&gt;** $x$"
+
+def test_rendered_html_is_shared_between_processes(monkeypatch):
+    # A card rendered in one process (a worker saving a copy, say) is served
+    # from the shared store in the next instead of being rendered again.
+    text = "**shared** $y^2$"
+    first = render(text)
+    rendering.render_card_html.cache_clear()
+    monkeypatch.setattr(rendering, "build_card_html", lambda text: pytest.fail("rendered again"))
+    assert rendering.render_card_html(2, text) == first
@@ -0,0 +1,75 @@
+import logging
+import threading
+import time
+
+# Only used when this file is run on its own; main.py and api.py take their own
+# timestamp before importing anything and pass it to warm_up(). For a breakdown
+# by module, run the entry point with python -X importtime.
+PROCESS_STARTED = time.perf_counter()
+
+import db
+import study_packs
+
+# Fills the connection pool and the hot caches before the first user shows up,
+# and reports how long each step took. api.py runs it on startup, main.py starts
+# it in the background on a process's first script run, and it can be run on its
+# own (python warmup.py) to fill the shared caches before a deploy.
+
+POPULAR_SET_COUNT = 20
+
+LOG_FORMAT = "%(asctime)s %(name)s %(levelname)s %(message)s"
+
+logger = logging.getLogger("quickflash.warmup")
+
+startup_timings = {}
+warmup_started = False
+warmup_lock = threading.Lock()
+
+def timed(name, step):
+    started = time.perf_counter()
+    try:
+        return step()
+    except Exception:
+        logger.exception("Warm-up step '%s' failed", name)
+    finally:
+        startup_timings[name] = time.perf_counter() - started
+
+def configure_logging():
+    # Neither Streamlit nor uvicorn sets up the root logger, so the app's INFO
+    # messages (this report among them) would otherwise be dropped. A logging
+    # setup made by whoever runs the app is left alone.
+    app_logger = logging.getLogger("quickflash")
+    if app_logger.handlers or logging.getLogger().handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    app_logger.addHandler(handler)
+    app_logger.setLevel(logging.INFO)
+
+def warm_up(started=PROCESS_STARTED):
+    configure_logging()
+    startup_timings["imports"] = time.perf_counter() - started
+    timed("connection pool", db.get_db_pool)
+    timed("subjects", db.get_subjects)
+    timed("published sets", db.get_published_flashcard_sets)
+    timed("like counts", db.get_published_like_counts)
+    popular = timed("popular sets", lambda: db.get_popular_set_ids(POPULAR_SET_COUNT)) or []
+    timed("study packs", lambda: [study_packs.get_study_pack(set_id) for set_id in popular])
+    startup_timings["total"] = time.perf_counter() - started
+
+    steps = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in startup_timings.items())
+    logger.info("QuickFlash warm-up: %s", steps)
+    return startup_timings
+
+def start_background_warmup(started):
+    # Streamlit has no server-start hook, so the first script run in a process
+    # kicks this off and carries on without waiting for it.
+    global warmup_started
+    with warmup_lock:
+        if warmup_started:
+            return
+        warmup_started = True
+    threading.Thread(target=warm_up, args=(started,), daemon=True).start()
+
+if __name__ == "__main__":
+    warm_up()
@@ -0,0 +1,192 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import threading
+import time
+
+import db
+
+# Runs jobs queued by the Streamlit app and the API. Each process claims one
+# job at a time with FOR UPDATE SKIP LOCKED, so any number of processes (or
+# machines) can share the jobs table without a separate broker.
+# Run with: python worker.py --processes 4
+
+POLL_SECONDS = 1.0
+RETRY_DELAY_SECONDS = 10
+STALE_JOB_MINUTES = 5
+HEARTBEAT_SECONDS = 30
+LOG_FORMAT = "%(asctime)s %(processName)s %(levelname)s %(message)s"
+
+logger = logging.getLogger("quickflash.worker")
+
+class JobCancelled(Exception):
+    pass
+
+# ----- HANDLERS -----
+# Handlers record their result in the same transaction as their changes (see
+# db.record_job_result), so a job whose worker dies after committing is finished
+# from that result instead of being run a second time.
+def run_copy_set(job_id, user_id, payload, report):
+    if not db.can_view_set(user_id, payload["set_id"]):
+        raise ValueError("set not found")
+    new_set_id = db.copy_flashcard_set(payload["set_id"], user_id, on_progress=report, job_id=job_id)
+    return {"new_set_id": new_set_id}
+
+def run_delete_set(job_id, user_id, payload, report):
+    if not db.delete_flashcard_set(payload["set_id"], user_id, on_progress=report, job_id=job_id):
+        raise ValueError("set not found or not yours")
+    return {"deleted": payload["set_id"]}
+
+JOB_HANDLERS = {
+    "copy_set": run_copy_set,
+    "delete_set": run_delete_set,
+}
+
+# ----- QUEUE -----
+def claim_job():
+    # Jobs left "running" by a worker that died are picked up again once their
+    # heartbeat stops. Ones that were cancelled meanwhile are marked cancelled,
+    # and ones that have used up their attempts are failed, so a job that
+    # keeps crashing workers stops.
+    with db.db_cursor() as cur:
+        cur.execute("""
+            UPDATE jobs
+            SET status = 'cancelled', updated_at = NOW()
+            WHERE status = 'running' AND cancel_requested AND result IS NULL
+              AND updated_at < NOW() - %s * INTERVAL '1 minute'
+        """, (STALE_JOB_MINUTES,))
+        cur.execute("""
+            UPDATE jobs
+            SET status = 'failed', error = 'worker stopped responding', updated_at = NOW()
+            WHERE status = 'running' AND NOT cancel_requested AND attempts >= max_attempts
+              AND result IS NULL AND updated_at < NOW() - %s * INTERVAL '1 minute'
+        """, (STALE_JOB_MINUTES,))
+        cur.execute("""
+            UPDATE jobs
+            SET status = 'running', attempts = attempts + 1, updated_at = NOW()
+            WHERE jobID = (
+                SELECT jobID FROM jobs
+                WHERE ((status = 'queued' AND NOT cancel_requested AND run_after <= NOW())
+                       OR (status = 'running' AND updated_at < NOW() - %s * INTERVAL '1 minute'
+                           AND (result IS NOT NULL
+                                OR (NOT cancel_requested AND attempts < max_attempts))))
+                ORDER BY jobID
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING jobID, kind, userID, payload, attempts, max_attempts, result
+        """, (STALE_JOB_MINUTES,))
+        job = cur.fetchone()
+    return job
+
+def report_progress(job_id, progress, total):
+    with db.db_cursor() as cur:
+        cur.execute("""
+            UPDATE jobs SET progress = %s, total = %s, updated_at = NOW()
+            WHERE jobID = %s
+            RETURNING cancel_requested
+        """, (progress, total, job_id))
+        row = cur.fetchone()
+    if row and row[0]:
+        raise JobCancelled()
+
+def touch_job(job_id):
+    with db.db_cursor() as cur:
+        cur.execute("UPDATE jobs SET updated_at = NOW() WHERE jobID = %s", (job_id,))
+
+def heartbeat(job_id, stopped):
+    # Keeps a job that spends a long time inside one query from looking stale
+    # and being claimed by a second worker.
+    while not stopped.wait(HEARTBEAT_SECONDS):
+        try:
+            touch_job(job_id)
+        except Exception:
+            logger.exception("Heartbeat for job %s failed", job_id)
+
+def finish_job(job_id, status, result=None, error=None, retry=False):
+    with db.db_cursor() as cur:
+        if retry:
+            cur.execute("""
+                UPDATE jobs
+                SET status = 'queued', error = %s, updated_at = NOW(),
+                    run_after = NOW() + attempts * %s * INTERVAL '1 second'
+                WHERE jobID = %s
+            """, (error, RETRY_DELAY_SECONDS, job_id))
+        else:
+            cur.execute("""
+                UPDATE jobs
+                SET status = %s, result = %s::jsonb, error = %s, updated_at = NOW(),
+                    progress = CASE WHEN %s = 'done' THEN total ELSE progress END
+                WHERE jobID = %s
+            """, (status, json.dumps(result) if result is not None else None, error, status, job_id))
+
+def run_job(job):
+    job_id, kind, user_id, payload, attempts, max_attempts, recorded = job
+    if recorded is not None:
+        # The work was committed but the worker died before marking it done.
+        finish_job(job_id, "done", result=recorded)
+        return
+    handler = JOB_HANDLERS.get(kind)
+    if handler is None:
+        finish_job(job_id, "failed", error=f"Unknown job kind '{kind}'")
+        return
+
+    stopped = threading.Event()
+    threading.Thread(target=heartbeat, args=(job_id, stopped), daemon=True).start()
+    try:
+        result = handler(job_id, user_id, payload, lambda done, total: report_progress(job_id, done, total))
+    except JobCancelled:
+        finish_job(job_id, "cancelled")
+    except ValueError as e:
+        finish_job(job_id, "failed", error=str(e))
+    except Exception as e:
+        logger.exception("Job %s (%s) failed", job_id, kind)
+        finish_job(job_id, "failed", error=str(e), retry=attempts < max_attempts)
+    else:
+        finish_job(job_id, "done", result=result)
+    finally:
+        stopped.set()
+
+def work():
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    while True:
+        try:
+            job = claim_job()
+        except Exception:
+            logger.exception("Could not claim a job")
+            job = None
+        if job is None:
+            time.sleep(POLL_SECONDS)
+            continue
+        # A database error while recording the outcome must not take the
+        # process down; the job goes stale and is retried from claim_job.
+        try:
+            run_job(job)
+        except Exception:
+            logger.exception("Could not finish job %s", job[0])
+
+def main():
+    parser = argparse.ArgumentParser(description="Run QuickFlash background jobs.")
+    parser.add_argument("--processes", type=int, default=2)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+
+    # Spawned rather than forked so each process opens its own connection pool.
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=work, daemon=True) for _ in range(args.processes)]
+    for process in workers:
+        process.start()
+
+    # Anything that still kills a worker (a segfault, the OOM killer) is
+    # replaced rather than leaving the pool a process short.
+    while True:
+        time.sleep(POLL_SECONDS)
+        for index, process in enumerate(workers):
+            if not process.is_alive():
+                logger.warning("Worker %s exited with code %s; restarting it", process.name, process.exitcode)
+                workers[index] = context.Process(target=work, daemon=True)
+                workers[index].start()
+
+if __name__ == "__main__":
+    main()